@@ -0,0 +1,134 @@
+import contextlib
+import json
+import multiprocessing.util
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; we then rely on the atomic rename only
+    fcntl = None
+
+
+class PersistentCache:
+    """
+    A key/value store that is kept in a JSON file, so that data fetched
+    from the network in one build can be reused by the next builds.
+
+    Entries expire *ttl* seconds after they were stored (never if *ttl* is
+    ``None``). If more than *max_entries* entries are stored, the least
+    recently used ones are evicted when saving. The times at which entries
+    are used are only recorded in that case, and they are written together
+    with the next change, so looking up entries doesn't rewrite the file.
+
+    Saving is atomic and merges the changes into what is currently on disk,
+    so several processes (for example, parallel Sphinx workers) can share
+    the same file without losing each other's entries. The processes take
+    turns through a lock file next to the store (*path* with ``.lock``
+    appended), which is kept for later builds.
+
+    Forked workers save their changes once, when they exit.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = self._read()
+        self._changed = set()
+        self._used = set()
+        self._pid = os.getpid()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry["stored"] > self.ttl
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry, time.time())
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or self._expired(entry, now):
+            return default
+        if self.max_entries is not None:
+            entry["used"] = now
+            self._used.add(key)
+        return entry["value"]
+
+    def set(self, key, value):
+        now = time.time()
+        self._entries[key] = {"value": value, "stored": now, "used": now}
+        self._changed.add(key)
+        # Forked parallel workers are discarded when they are done, so
+        # anything they fetched is written out when they exit
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            multiprocessing.util.Finalize(self, self.save, exitpriority=0)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def save(self):
+        if not self._changed:
+            return
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock():
+            entries = self._read()
+            for key in self._used - self._changed:
+                if key in entries:
+                    entries[key]["used"] = max(
+                        entries[key]["used"], self._entries[key]["used"]
+                    )
+            for key in self._changed:
+                entries[key] = self._entries[key]
+
+            now = time.time()
+            entries = {
+                key: entry
+                for key, entry in entries.items()
+                if not self._expired(entry, now)
+            }
+            if self.max_entries is not None and len(entries) > self.max_entries:
+                keep = sorted(
+                    entries, key=lambda key: entries[key]["used"], reverse=True
+                )[: self.max_entries]
+                entries = {key: entries[key] for key in keep}
+
+            fd, tmpname = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmpname, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmpname)
+                raise
+
+        self._entries = entries
+        self._changed.clear()
+        self._used.clear()
@@ -1,4 +1,7 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import json
+import os
+import re
 from docutils import nodes
 from docutils.parsers.rst import directives
 from docutils.statemachine import ViewList
@@ -11,16 +14,76 @@ from . import common
 
 logger = logging.getLogger(__name__)
 
+# The HTML of the option details of each document in lazy mode, which is
+# collected while the document is written (see depart_details) and saved
+# when the page is written (see save_details)
+renderedDetails = {}
+
+
+# Values that are plain text: they start with a letter or digit and don't
+# contain anything that could start inline markup, a role or a hyperlink
+plainValue = re.compile(r"[^\W_](?:[^\W_]|[ .,;()'\"/+=%!?-])*")
+# Values that would be parsed as the start of an enumerated list
+enumerator = re.compile(r"\(?\w+[.)](\s|$)")
+
 
 # Parse rST inside an option (":something:")
 def parseOption(obj, option):
     newNode = nodes.inline()
+
+    # Plain values result in a paragraph with the text, so there's no
+    # need to run the parser
+    if plainValue.fullmatch(option) and not enumerator.match(option):
+        text = option.rstrip()
+        paragraph = nodes.paragraph(text, "", nodes.Text(text))
+        # Same as what the parser records for the line in parseNode below
+        paragraph.source, paragraph.line = "parsing", 2
+        newNode += paragraph
+        return newNode
+
     parseNode = ViewList()
     parseNode.append(option, "parsing", 1)
     obj.state.nested_parse(parseNode, 0, newNode)
     return newNode
 
 
+# The details of an option in lazy mode. Builders other than HTML handle
+# this node like any other container.
+class configoption_details(nodes.container):
+    pass
+
+
+# Builders that use the HTML handlers because of their format (for example,
+# epub) don't include the files with the details, so they get the details
+# in the page
+lazy_builders = ("html", "dirhtml")
+
+
+def visit_details(self, node):
+    if self.builder.name not in lazy_builders:
+        self.visit_container(node)
+        return
+    pageDetails = renderedDetails.setdefault(self.builder.current_docname, [])
+    self.body.append(self.starttag(
+        node, "div", CLASS="docutils container", hidden="hidden",
+        **{"data-details": len(pageDetails)}
+    ))
+    self.context.append(len(self.body))
+
+
+# Move the HTML of the details out of the page
+def depart_details(self, node):
+    if self.builder.name not in lazy_builders:
+        self.depart_container(node)
+        return
+    start = self.context.pop()
+    renderedDetails[self.builder.current_docname].append(
+        "".join(self.body[start:])
+    )
+    del self.body[start:]
+    self.body.append("</div>\n")
+
+
 class ConfigOption(ObjectDescription):
 
     optional_fields = {
@@ -90,7 +153,10 @@ class ConfigOption(ObjectDescription):
         firstLine += shortDesc
         firstLine += anchor
 
-        details = nodes.container()
+        if self.env.config.config_options_lazy:
+            details = configoption_details()
+        else:
+            details = nodes.container()
         details["classes"].append("details")
         fields = nodes.table()
         fields["classes"].append("fields")
@@ -138,7 +204,12 @@ class ConfigOption(ObjectDescription):
         # Register the target with the domain
 
         configDomain = self.env.get_domain("config")
-        configDomain.add_option(self.arguments[0], scope)
+        fields = {
+            field: self.options[field]
+            for field in ["shortdesc", *self.optional_fields]
+            if field in self.options
+        }
+        configDomain.add_option(self.arguments[0], scope, fields)
 
         # Return the content and target node
 
@@ -151,6 +222,16 @@ class ConfigIndex(Index):
     name = "options"
     localname = "Configuration options"
 
+    # Return the title of the document as HTML
+    def get_title(self, docname):
+        title = str(self.domain.env.titles[docname])
+        # need some tweaking to work with our CSS
+        title = title.replace("<title>", "")
+        title = title.replace("</title>", "")
+        title = title.replace("<literal>", '<code class="literal">')
+        title = title.replace("</literal>", "</code>")
+        return title
+
     def generate(self, docnames=None):
         content = defaultdict(list)
 
@@ -158,15 +239,11 @@ class ConfigIndex(Index):
         # sort by key name
         options = sorted(options, key=lambda option: (option[1], option[4]))
 
-        dispnames = []
-        duplicates = []
-        for _name, dispname, _typ, _docname, anchor, _priority in options:
-            fullname = anchor.partition(":")[0].partition("-")[0] \
-                + "-" + dispname
-            if fullname in dispnames:
-                duplicates.append(fullname)
-            else:
-                dispnames.append(fullname)
+        fullnames = Counter(
+            anchor.partition(":")[0].partition("-")[0] + "-" + dispname
+            for _name, dispname, _typ, _docname, anchor, _priority in options
+        )
+        titles = {}
 
         for _name, dispname, typ, docname, anchor, _priority in options:
 
@@ -174,15 +251,12 @@ class ConfigIndex(Index):
 
             # if the key exists more than once within the scope, add
             # the title of the document as extra context
-            if scope[0] + "-" + dispname in duplicates:
-                extra = str(self.domain.env.titles[docname])
-                # need some tweaking to work with our CSS
-                extra = extra.replace("<title>", "")
-                extra = extra.replace("</title>", "")
-                extra = extra.replace("<literal>", '<code class="literal">')
-                extra = extra.replace("</literal>", "</code>")
+            if fullnames[scope[0] + "-" + dispname] > 1:
+                if docname not in titles:
+                    titles[docname] = self.get_title(docname)
                 # add the anchor for full information
-                extra += ': <code class="literal">' + scope[2] + "</code>"
+                extra = titles[docname] + ': <code class="literal">' \
+                    + scope[2] + "</code>"
             else:
                 extra = ""
 
@@ -204,10 +278,17 @@ class ConfigDomain(Domain):
     roles = {"option": XRefRole()}
     directives = {"option": ConfigOption}
     indices = {ConfigIndex}
-    initial_data = {"config_options": []}
+    # The options are stored by anchor ("scope:key"); each anchor maps to
+    # the list of its definitions, ordered by document (so that parallel
+    # builds link to the same definition as serial builds). "documents"
+    # maps each document to the anchors that it defines, and "fields" maps
+    # each document to the fields of its options (by anchor).
+    initial_data = {"config_options": {}, "documents": {}, "fields": {}}
+    data_version = 3
 
     def get_objects(self):
-        yield from self.data["config_options"]
+        for options in self.data["config_options"].values():
+            yield from options
 
     # Find the node that is being referenced
     def resolve_xref(self, env, fromdocname, builder, typ, target,
@@ -217,16 +298,10 @@ class ConfigDomain(Domain):
         if ":" not in target:
             target = "server:" + target
 
-        match = [
-            (key, docname, anchor)
-            for key, sig, typ, docname, anchor, prio in self.get_objects()
-            if anchor == target and typ == "option"
-        ]
+        options = self.data["config_options"].get(target)
 
-        if len(match) > 0:
-            title = match[0][0]
-            todocname = match[0][1]
-            targ = match[0][2]
+        if options:
+            title, _sig, _typ, todocname, targ, _prio = options[0]
 
             refNode = make_refnode(
                 builder, fromdocname, todocname, targ,
@@ -247,21 +322,103 @@ class ConfigDomain(Domain):
         return []
 
     # Store the option
-    def add_option(self, key, scope):
-
-        self.data["config_options"].append(
-            (key, key, "option", self.env.docname, scope + ":" + key, 0)
-        )
+    def add_option(self, key, scope, fields=None):
+
+        anchor = scope + ":" + key
+        self._add(anchor, (key, key, "option", self.env.docname, anchor, 0))
+        self.data["documents"].setdefault(self.env.docname, set()).add(anchor)
+        self.data["fields"].setdefault(self.env.docname, {})[anchor] = \
+            fields or {}
+
+    def _add(self, anchor, option):
+        options = self.data["config_options"].setdefault(anchor, [])
+        options.append(option)
+        if len(options) > 1:
+            options.sort(key=lambda option: option[3])
+
+    # Remove the options of a document that is read again or was removed
+    def clear_doc(self, docname):
+
+        self.data["fields"].pop(docname, None)
+        options = self.data["config_options"]
+        for anchor in self.data["documents"].pop(docname, ()):
+            remaining = [
+                option for option in options[anchor] if option[3] != docname
+            ]
+            if remaining:
+                options[anchor] = remaining
+            else:
+                del options[anchor]
 
     def merge_domaindata(self, docnames, otherdata):
 
-        for option in otherdata["config_options"]:
-            if option not in self.data["config_options"]:
-                self.data["config_options"].append(option)
+        for docname in docnames:
+            anchors = otherdata["documents"].get(docname)
+            if not anchors:
+                continue
+            self.data["documents"].setdefault(docname, set()).update(anchors)
+            self.data["fields"][docname] = otherdata["fields"][docname]
+            for anchor in anchors:
+                for option in otherdata["config_options"][anchor]:
+                    if option[3] == docname:
+                        self._add(anchor, option)
+
+
+# Write the details that were moved out of the page to a script that is
+# loaded when the first option is expanded (see config-options.js)
+def save_details(app, pagename, templatename, context, doctree):
+    pageDetails = renderedDetails.pop(pagename, None)
+    if not pageDetails:
+        return
+
+    filename = os.path.join("_config-options", pagename + ".js")
+    path = os.path.join(app.outdir, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("window.configOptionsDetails = ")
+        json.dump(pageDetails, f, separators=(",", ":"))
+        f.write(";\n")
+
+    context["metatags"] += '\n<meta name="config-options-details" ' \
+        + 'content="' + context["pathto"](filename, 1) + '" />'
+
+
+# Export all options (with the unparsed values of their fields) to a
+# JSON file, which can be used by other tools
+def export_options(app, exc):
+    if exc or app.builder.format != "html":
+        return
+
+    domain = app.env.get_domain("config")
+    options = []
+    for key, _dispname, _typ, docname, anchor, _prio in sorted(
+        domain.get_objects(), key=lambda option: (option[4], option[3])
+    ):
+        options.append({
+            "key": key,
+            "scope": anchor.partition(":")[0],
+            "anchor": anchor,
+            "doc": docname,
+            "uri": app.builder.get_target_uri(docname) + "#" + anchor,
+            "fields": domain.data["fields"].get(docname, {}).get(anchor, {}),
+        })
+
+    with open(
+        os.path.join(app.outdir, "config-options.json"), "w", encoding="utf-8"
+    ) as f:
+        json.dump(options, f, separators=(",", ":"))
 
 
 def setup(app):
+    app.add_config_value("config_options_lazy", False, "env")
     app.add_domain(ConfigDomain)
+    app.add_node(
+        configoption_details,
+        html=(visit_details, depart_details),
+        dirhtml=(visit_details, depart_details),
+    )
+    app.connect("html-page-context", save_details)
+    app.connect("build-finished", export_options)
 
     common.add_css(app, "config-options.css")
     common.add_js(app, "config-options.js")
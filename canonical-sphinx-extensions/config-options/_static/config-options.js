@@ -1,53 +1,125 @@
 $(document).ready(function() {
 
-    /* Request one frame to avoid scrolling before collapsing content */
-    window.requestAnimationFrame();
+    /* In lazy mode, the details of the options are not part of the page.
+       They are loaded from a separate file when the first option is
+       expanded. */
+    var source = $('meta[name="config-options-details"]').attr('content');
+    var loaded = null;
 
-    /* Hide all details except if the URL has an anchor for one */
-    $('.configoption div.details').prop("hidden","until-found");
+    function loadDetails() {
+        if (loaded === null) {
+            loaded = $.Deferred();
+            var script = document.createElement('script');
+            script.src = source;
+            script.onload = function() {
+                loaded.resolve(window.configOptionsDetails);
+            };
+            script.onerror = function() {
+                loaded.reject();
+            };
+            document.head.appendChild(script);
+        }
+        return loaded;
+    }
 
-    if ($(location).attr('hash')) {
-        $('div#'+$.escapeSelector($(location).attr('hash').substr(1))+" > .details").removeAttr("hidden");
-    };
+    function expand(details) {
+        if (source === undefined || !details.is('[data-details]')) {
+            details.removeAttr("hidden");
+            return $.Deferred().resolve();
+        }
+        return loadDetails().done(function(data) {
+            details.each(function() {
+                var index = this.getAttribute('data-details');
+                if (index !== null) {
+                    this.innerHTML = data[index];
+                    this.removeAttribute('data-details');
+                }
+                this.removeAttribute('hidden');
+            });
+        });
+    }
+
+    function collapse(details) {
+        details.prop("hidden","until-found");
+    }
+
+    /* Targets inside the details of an option (for example, labels in
+       its description) only exist once the details are loaded, so if the
+       URL has an anchor that is missing, expand the option that has it */
+    function showAnchor() {
+        var hash = $(location).attr('hash');
+        if (!hash) {
+            return;
+        }
+        var id = hash.substr(1);
+        if ($('div#'+$.escapeSelector(id)).length) {
+            expand($('div#'+$.escapeSelector(id)+" > .details"));
+        }
+        else if (source !== undefined && document.getElementById(id) === null) {
+            loadDetails().done(function(data) {
+                var details = $('.configoption div.details[data-details]').filter(function() {
+                    var html = document.createElement('template');
+                    html.innerHTML = data[this.getAttribute('data-details')];
+                    return html.content.getElementById(id) !== null;
+                });
+                expand(details).done(function() {
+                    var target = document.getElementById(id);
+                    if (target !== null) {
+                        target.scrollIntoView();
+                    }
+                });
+            });
+        };
+    }
+
+    /* Hide all details except if the URL has an anchor for one */
+    collapse($('.configoption div.details'));
+    showAnchor();
+    $(window).on('hashchange', showAnchor);
 
     /* Add icons to expand/collapse all options for one section */
     $('.configoption').before("<div class=\"expand-collapse\"><span class=\"expand-all\" title=\"Expand all\">⤋</span><span class=\"collapse-all\" title=\"Collapse all\">⤊</span></div>");
     $('.configoption ~ .configoption').prev(".expand-collapse").remove();
 
+    /* The handlers are attached to the document only once instead of to
+       every option */
+
     /* Make the option lines expandable */
-    $('.configoption div.basicinfo').click(function() {
-        if ($(this).nextAll('.configoption .details').first().prop("hidden")) {
-            $(this).nextAll('.configoption .details').first().removeAttr("hidden");
+    $(document).on('click', '.configoption div.basicinfo', function() {
+        var details = $(this).nextAll('.configoption .details').first();
+        if (details.prop("hidden")) {
+            expand(details);
         }
         else {
-            $(this).nextAll('.configoption .details').first().prop("hidden","until-found");
+            collapse(details);
         }
     });
 
     /* Expand/collapse all options in a section */
-    $('.expand-all').click(function() {
-        $(this).parent().nextAll('.configoption').find('.details').removeAttr("hidden");
+    $(document).on('click', '.expand-all', function() {
+        expand($(this).parent().nextAll('.configoption').find('.details'));
     });
 
-    $('.collapse-all').click(function() {
-        $(this).parent().nextAll('.configoption').find('.details').prop("hidden","until-found");
+    $(document).on('click', '.collapse-all', function() {
+        collapse($(this).parent().nextAll('.configoption').find('.details'));
     });
 
     /* When clicking a config reference, expand it automatically */
-    $('.configref').click(function() {
+    $(document).on('click', '.configref', function() {
         if ($(this).attr('href').substr(0,1) == "#") {
-            $('.configoption div.details').prop("hidden","until-found");
-            $('#'+$.escapeSelector($(this).attr('href').substr(1))+" .details").removeAttr("hidden");
+            collapse($('.configoption div.details'));
+            expand($('#'+$.escapeSelector($(this).attr('href').substr(1))+" .details"));
         };
     });
 
-    /* If searching in hidden content is not supported, add an
-       "Expand all options" link at the top of the page. */
-    if (!('onbeforematch' in document.body)) {
+    /* If searching in hidden content is not supported, or if the details
+       haven't been loaded (lazy mode), add an "Expand all options" link at
+       the top of the page. */
+    if (!('onbeforematch' in document.body) || (source !== undefined && $('.configoption').length)) {
         $('.main .content article h1:first-of-type').after("<div id=\"expand-options\">⤋ Expand all options</div>");
 
         $('#expand-options').click(function() {
-            $('.configoption div.details').removeAttr("hidden");
+            expand($('.configoption div.details'));
 
         });
     };
@@ -1,12 +1,40 @@
-from git import Repo, InvalidGitRepositoryError
+from git import Repo, InvalidGitRepositoryError, GitCommandError
+from sphinx.config import ENUM
 from sphinx.util import logging
+import codecs
 import os
 from . import common
+from .cache import PersistentCache
 
 logger = logging.getLogger(__name__)
 
+# The index of the Git history for this build, which is loaded before the
+# documents are read (see update_outdated)
+index = None
+
+# The settings from html_context, which are resolved once when the builder
+# is initialised (see init_settings). repo_dir is None if no contributors
+# should be displayed.
+repo_dir = None
+folder = ""
+since = None
+commit_url = ""
+
+# Parallel write workers are forked, so each process opens the repository
+# itself instead of sharing the Git processes of another one (see get_repo)
+_repo = None
+_repo_pid = None
+
 
 def setup(app):
+    app.add_config_value(
+        "contributors_git_backend", "gitpython", "", ENUM("gitpython", "git")
+    )
+    app.connect("builder-inited", init_settings)
+    app.connect("env-get-outdated", update_outdated)
+    app.connect("doctree-read", store_contributors)
+    app.connect("env-merge-info", merge_contributors)
+    app.connect("env-purge-doc", purge_contributors)
     app.connect("html-page-context", setup_func)
 
     common.add_css(app, "contributors.css")
@@ -17,73 +45,340 @@ def setup(app):
             "parallel_write_safe": True}
 
 
-def setup_func(app, pagename, templatename, context, doctree):
-    def get_contributors_for_file(pagename, page_source_suffix):
+# Find the files that each commit changed, with a single call to git log.
+# Merge commits list the files that differ from all of their parents,
+# which are the files for which they show up in the history of a file.
+def get_changed_files(repo, rev, paths, since):
+    files = {}
+    sha = None
+    for line in repo.git.log(
+        "--name-only", "--no-renames", "-c", "--format=%x00%H",
+        rev, "--", *paths, since=since
+    ).splitlines():
+        if line.startswith("\x00"):
+            sha = line[1:]
+            files[sha] = []
+        elif line:
+            files[sha].append(line)
+    return files
 
-        if (
-            "display_contributors" not in context
-            or "github_folder" not in context
-            or "github_url" not in context
-        ):
-            return []
 
-        if context["display_contributors"]:
-            filename = f"{pagename}{page_source_suffix}"
-            paths = context["github_folder"][1:] + filename
-
-            try:
-                repo = Repo(".")
-            except InvalidGitRepositoryError:
-                cwd = os.getcwd()
-                ghfolder = context["github_folder"][:-1]
-                if ghfolder and cwd.endswith(ghfolder):
-                    repo = Repo(cwd.rpartition(ghfolder)[0])
-                else:
-                    logger.warning(
-                        "The local Git repository could not be found."
-                    )
-                    return
-
-            since = None
+# Backend that uses GitPython to go through the commits
+def iter_commits_gitpython(repo, rev, paths, since):
+    files = get_changed_files(repo, rev, paths, since)
+    for commit in repo.iter_commits(rev, paths=paths, since=since):
+        contributors = [commit.author.name]
+        for co_author in commit.co_authors:
+            contributors.append(co_author.name)
+        yield (commit.hexsha, commit.committed_date, contributors,
+               files.get(commit.hexsha, []))
+
+
+# Return the names of the co-authors in a commit message (in the same way
+# as GitPython's Commit.co_authors)
+def parse_co_authors(message):
+    co_authors = []
+    prefix = "Co-authored-by: "
+    for line in message.split("\n"):
+        if not line.startswith(prefix) or not line.endswith(">"):
+            continue
+        identity = line[len(prefix):]
+        separator = identity.rfind(" <")
+        if separator != -1:
+            co_authors.append(identity[:separator])
+    return co_authors
+
+
+# Each commit starts with \x00, its fields are separated by \x1f and the
+# commit message ends with \x1e. The changed files follow on separate lines.
+log_format = "%x00%H%x1f%ct%x1f%an%x1f%B%x1e"
+
+
+def parse_log_record(record):
+    header, _, files = record.partition("\x1e")
+    sha, date, author, message = header.split("\x1f", 3)
+    return (sha, int(date), [author] + parse_co_authors(message),
+            [line for line in files.split("\n") if line])
+
+
+# Backend that reads the output of a single git log call while it is
+# running, so that no commit objects need to be loaded
+def iter_commits_git(repo, rev, paths, since):
+    process = repo.git.log(
+        "--name-only", "--no-renames", "-c", "--format=" + log_format,
+        rev, "--", *paths, since=since, as_process=True
+    )
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    buffer = ""
+    for chunk in iter(lambda: process.stdout.read(65536), b""):
+        buffer += decoder.decode(chunk)
+        *records, buffer = buffer.split("\x00")
+        for record in records:
+            if record:
+                yield parse_log_record(record)
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield parse_log_record(buffer)
+    # Raises GitCommandError if git log failed
+    process.wait()
+
 
+backends = {
+    "gitpython": iter_commits_gitpython,
+    "git": iter_commits_git,
+}
+
+
+# Walk through the commits in rev once and map the path of each file
+# (relative to the root of the repository) to a dict of the contributors to
+# that file and the date and SHA of their latest commit to it
+def build_index(repo, rev, folder, since, backend="gitpython"):
+    paths = [folder] if folder else []
+
+    index = {}
+    iter_commits = backends.get(backend, iter_commits_gitpython)
+    for sha, date, contributors, files in iter_commits(
+        repo, rev, paths, since
+    ):
+        for path in files:
+            contributors_dict = index.setdefault(path, {})
+            for contributor in contributors:
+                if (
+                    contributor not in contributors_dict
+                    or date > contributors_dict[contributor]["date"]
+                ):
+                    contributors_dict[contributor] = {
+                        "date": date,
+                        "sha": sha,
+                    }
+    return index
+
+
+# Merge the index of newer commits into an existing index. The newer
+# commits win if the dates are the same, like when walking the history.
+def merge_index(index, newer):
+    for path, newer_dict in newer.items():
+        contributors_dict = index.setdefault(path, {})
+        for contributor, data in newer_dict.items():
             if (
-                "display_contributors_since" in context
-                and context["display_contributors_since"]
-                and context["display_contributors_since"].strip()
+                contributor not in contributors_dict
+                or data["date"] >= contributors_dict[contributor]["date"]
             ):
-                since = context["display_contributors_since"]
-
-            try:
-                commits = repo.iter_commits(paths=paths, since=since)
-            except ValueError as e:
-                logger.warning(
-                    "Failed to iterate through the Git commits: " + str(e)
-                )
-                return
-
-            contributors_dict = {}
-            for commit in commits:
-                contributors = [commit.author.name]
-                for co_author in commit.co_authors:
-                    contributors.append(co_author.name)
-                for contributor in contributors:
-                    if (
-                        contributor not in contributors_dict
-                        or commit.committed_date > contributors_dict[contributor]["date"]
-                    ):
-                        contributors_dict[contributor] = {
-                            "date": commit.committed_date,
-                            "sha": commit.hexsha,
-                        }
-            # github_page contains the link to the contributor's latest commit
-            contributors_list = [
-                (name, f"{context['github_url']}/commit/{data['sha']}")
-                for name, data in contributors_dict.items()
-            ]
-
-            return sorted(contributors_list)
-
-        else:
+                contributors_dict[contributor] = data
+    return index
+
+
+# Return the commit date from which on contributors are listed, which is
+# what git log uses for --since
+def get_cutoff(repo, since):
+    if not since:
+        return None
+    # Prints "--max-age=<timestamp>"
+    return int(repo.git.rev_parse("--since=" + since).partition("=")[2])
+
+
+# Drop the contributors whose latest commit is older than the cutoff (the
+# start date moves on if it is relative, like "3 months ago")
+def prune_index(index, cutoff):
+    if cutoff is None:
+        return index
+    pruned = {}
+    for path, contributors_dict in index.items():
+        contributors_dict = {
+            name: data
+            for name, data in contributors_dict.items()
+            if data["date"] >= cutoff
+        }
+        if contributors_dict:
+            pruned[path] = contributors_dict
+    return pruned
+
+
+def is_ancestor(repo, ancestor, rev):
+    try:
+        return repo.is_ancestor(ancestor, rev)
+    except GitCommandError:
+        # The commit doesn't exist anymore
+        return False
+
+
+# Load the index that was saved by an earlier build and bring it up to date
+# with HEAD by processing only the commits since then. The index is built
+# from scratch if the history was rewritten since (for example, by a rebase)
+# or if there is no earlier index for the folder and start date.
+def load_index(app, repo, folder, since):
+    store = PersistentCache(
+        os.path.join(app.doctreedir, "contributors.json"), max_entries=16
+    )
+    key = "\x00".join((repo.working_dir, folder, since or ""))
+    head = repo.head.commit.hexsha
+    backend = app.config.contributors_git_backend
+
+    stored = store.get(key)
+    if stored is not None and stored["head"] == head:
+        return prune_index(stored["index"], get_cutoff(repo, since))
+
+    if stored is not None and is_ancestor(repo, stored["head"], head):
+        index = merge_index(
+            stored["index"],
+            build_index(
+                repo, stored["head"] + ".." + head, folder, since, backend
+            )
+        )
+    else:
+        index = build_index(repo, head, folder, since, backend)
+    index = prune_index(index, get_cutoff(repo, since))
+
+    store.set(key, {"head": head, "index": index})
+    store.save()
+    return index
+
+
+# Find the root of the Git repository, either from the current directory
+# or by removing github_folder from it
+def find_repo_dir(github_folder):
+    try:
+        return Repo(".").working_dir
+    except InvalidGitRepositoryError:
+        cwd = os.getcwd()
+        ghfolder = github_folder[:-1]
+        if ghfolder and cwd.endswith(ghfolder):
+            return Repo(cwd.rpartition(ghfolder)[0]).working_dir
+        return None
+
+
+def init_settings(app):
+    global repo_dir, folder, since, commit_url
+
+    context = app.config.html_context
+    repo_dir = None
+    # Only HTML pages show the contributors
+    if app.builder.format != "html":
+        return
+    if (
+        not context.get("display_contributors")
+        or "github_folder" not in context
+        or "github_url" not in context
+    ):
+        return
+
+    repo_dir = find_repo_dir(context["github_folder"])
+    if repo_dir is None:
+        logger.warning("The local Git repository could not be found.")
+        return
+
+    folder = context["github_folder"][1:]
+    since = None
+    if (
+        context.get("display_contributors_since")
+        and context["display_contributors_since"].strip()
+    ):
+        since = context["display_contributors_since"]
+    # Links point to the contributor's latest commit
+    commit_url = f"{context['github_url']}/commit/"
+
+
+def get_repo():
+    global _repo, _repo_pid
+    if _repo is None or _repo_pid != os.getpid():
+        _repo = Repo(repo_dir)
+        _repo_pid = os.getpid()
+    return _repo
+
+
+# Return the sorted names of the contributors to a page and the SHAs of
+# their latest commits to it
+def lookup_contributors(pagename, page_source_suffix):
+    contributors_dict = index.get(
+        f"{folder}{pagename}{page_source_suffix}", {}
+    )
+    return sorted(
+        (name, data["sha"]) for name, data in contributors_dict.items()
+    )
+
+
+def get_source_suffix(env, docname):
+    return str(env.doc2path(docname, False))[len(docname):]
+
+
+# Bring the index up to date before the documents are read, so that the
+# parallel read and write workers (which are forked) inherit it. Pages
+# that aren't read again but have different contributors now (because of
+# new commits, or because the start date moved on) are marked as outdated.
+def update_outdated(app, env, added, changed, removed):
+    global index
+
+    if not hasattr(env, "contributor_listing"):
+        env.contributor_listing = {}
+
+    index = None
+    if repo_dir is None:
+        return []
+
+    try:
+        index = load_index(app, get_repo(), folder, since)
+    except (ValueError, GitCommandError) as e:
+        logger.warning("Failed to iterate through the Git commits: " + str(e))
+        return []
+
+    return [
+        docname
+        for docname, contributors in env.contributor_listing.items()
+        if docname not in changed
+        and docname in env.found_docs
+        and contributors != lookup_contributors(
+            docname, get_source_suffix(env, docname)
+        )
+    ]
+
+
+def store_contributors(app, doctree):
+    if index is not None:
+        env = app.env
+        env.contributor_listing[env.docname] = lookup_contributors(
+            env.docname, get_source_suffix(env, env.docname)
+        )
+
+
+def merge_contributors(app, env, docnames, other):
+    for docname in docnames:
+        if docname in other.contributor_listing:
+            env.contributor_listing[docname] = \
+                other.contributor_listing[docname]
+
+
+def purge_contributors(app, env, docname):
+    if hasattr(env, "contributor_listing"):
+        env.contributor_listing.pop(docname, None)
+
+
+def setup_func(app, pagename, templatename, context, doctree):
+    contributors = []
+    if repo_dir is not None:
+        stored = app.env.contributor_listing.get(pagename)
+        if stored is None and index is not None:
+            stored = lookup_contributors(
+                pagename, context.get("page_source_suffix", "")
+            )
+        if stored:
+            contributors = [(name, commit_url + sha) for name, sha in stored]
+
+    # An alphabetical list of tuples that contain the name of the contributor
+    # and the link to their latest commit to the page
+    context["contributors"] = contributors
+
+    # Kept for templates that look up the contributors themselves
+    def get_contributors_for_file(pagename, page_source_suffix):
+        if repo_dir is None or index is None:
             return []
+        if (
+            pagename == context["pagename"]
+            and page_source_suffix == context.get("page_source_suffix")
+        ):
+            return contributors
+        return [
+            (name, commit_url + sha)
+            for name, sha in lookup_contributors(pagename, page_source_suffix)
+        ]
 
     context["get_contributors_for_file"] = get_contributors_for_file
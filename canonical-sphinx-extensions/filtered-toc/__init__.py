@@ -1,15 +1,140 @@
+import functools
 import re
 from sphinx.directives.other import TocTree
+from sphinx.errors import ConfigError
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
 
 
 def setup(app):
     app.add_config_value("toc_filter_exclude", [], "html")
+    app.add_config_value("toc_filter_profiles", {}, "")
+    app.add_config_value("toc_filter_profile", "", "")
     app.add_directive("filtered-toctree", FilteredTocTree)
+    app.connect("config-inited", apply_profile)
+    app.connect("env-get-outdated", find_outdated)
+    app.connect("env-merge-info", merge_filtered)
+    app.connect("env-purge-doc", purge_filtered)
     return {"version": "1.0.0",
             "parallel_read_safe": True,
             "parallel_write_safe": True}
 
 
+# The filters to exclude, which are collected into a set only once for
+# each value of toc_filter_exclude
+@functools.lru_cache(maxsize=None)
+def get_excluded(exclude):
+    return frozenset(exclude)
+
+
+# Use the filters of the selected profile instead of toc_filter_exclude
+def apply_profile(app, config):
+    profile = config.toc_filter_profile
+    if not profile:
+        return
+    if profile not in config.toc_filter_profiles:
+        raise ConfigError(
+            f"The filter profile {profile} is not defined in "
+            "toc_filter_profiles."
+        )
+    config.toc_filter_exclude = list(config.toc_filter_profiles[profile])
+
+
+# The filters only change the entries of the filtered toctrees, so if the
+# filters are different from the ones that the environment was read with,
+# only the documents that contain a filtered toctree are read again. All
+# other doctrees are reused, which means that builds for different
+# profiles can share one doctree directory.
+def find_outdated(app, env, added, changed, removed):
+    if not hasattr(env, "filtered_toc_docs"):
+        env.filtered_toc_docs = set()
+
+    excl = get_excluded(tuple(app.config.toc_filter_exclude))
+    read_with = getattr(env, "filtered_toc_exclude", excl)
+    env.filtered_toc_exclude = excl
+    if read_with == excl:
+        return []
+    return [
+        docname
+        for docname in env.filtered_toc_docs
+        if docname not in changed and docname in env.found_docs
+    ]
+
+
+def merge_filtered(app, env, docnames, other):
+    env.filtered_toc_docs.update(
+        docname for docname in docnames
+        if docname in other.filtered_toc_docs
+    )
+
+
+def purge_filtered(app, env, docname):
+    if hasattr(env, "filtered_toc_docs"):
+        env.filtered_toc_docs.discard(docname)
+
+
+# The tags and operators in a filter expression (whitespace around them is
+# ignored, so tags can still contain spaces)
+filterToken = re.compile(r"[&|!()]|[^&|!()\s](?:[^&|!()]*[^&|!()\s])?")
+
+
+# Compile a filter expression (for example, "linux&!arm") into a predicate
+# that takes the set of excluded filters and returns whether the entry is
+# included. A tag is true unless it is excluded. "!" binds closer than
+# "&", which binds closer than "|". Each expression is compiled only once.
+@functools.lru_cache(maxsize=None)
+def compile_filter(expression):
+    tokens = filterToken.findall(expression)
+    predicate, pos = parse_or(tokens, 0)
+    if pos != len(tokens):
+        raise ValueError(f"unexpected {tokens[pos]!r}")
+    return predicate
+
+
+def parse_or(tokens, pos):
+    operands = []
+    while True:
+        operand, pos = parse_and(tokens, pos)
+        operands.append(operand)
+        if pos == len(tokens) or tokens[pos] != "|":
+            break
+        pos += 1
+    if len(operands) == 1:
+        return operands[0], pos
+    return (lambda excl: any(o(excl) for o in operands)), pos
+
+
+def parse_and(tokens, pos):
+    operands = []
+    while True:
+        operand, pos = parse_not(tokens, pos)
+        operands.append(operand)
+        if pos == len(tokens) or tokens[pos] != "&":
+            break
+        pos += 1
+    if len(operands) == 1:
+        return operands[0], pos
+    return (lambda excl: all(o(excl) for o in operands)), pos
+
+
+def parse_not(tokens, pos):
+    if pos == len(tokens):
+        raise ValueError("unexpected end of the expression")
+    token = tokens[pos]
+    if token == "!":
+        operand, pos = parse_not(tokens, pos + 1)
+        return (lambda excl: not operand(excl)), pos
+    if token == "(":
+        operand, pos = parse_or(tokens, pos + 1)
+        if pos == len(tokens) or tokens[pos] != ")":
+            raise ValueError("missing ')'")
+        return operand, pos + 1
+    if token in ("&", "|", ")"):
+        raise ValueError(f"unexpected {token!r}")
+    return (lambda excl: token not in excl), pos + 1
+
+
 class FilteredTocTree(TocTree):
 
     findFilter = re.compile(r"^\s*:(.+?):.+$|^.*<:(.+?):.+>$")
@@ -17,29 +142,42 @@ class FilteredTocTree(TocTree):
     # Go through all toctree entries and check if they should be included.
     # If they should be included, remove the filter (":something:").
     def filter_entries(self, entries):
-        excl = self.state.document.settings.env.config.toc_filter_exclude
+        config = self.state.document.settings.env.config
+        excl = get_excluded(tuple(config.toc_filter_exclude))
         filtered = []
         for e in entries:
             m = self.findFilter.match(e)
 
             if m is not None:
-                # The filter is in different matches depending on whether
+                # The filter is in different groups depending on whether
                 # we override the title and where we put the filter
-                if e.startswith(":"):
-                    filt = m.groups()[0]
-                elif e.endswith(">"):
-                    filt = m.groups()[1]
-                else:
-                    filt = m.groups()[0]
+                group = m.lastindex
+                expression = m.group(group)
+                try:
+                    included = compile_filter(expression)(excl)
+                except ValueError as err:
+                    # Use the whole filter as a tag
+                    logger.warning(
+                        f"Invalid filter expression {expression!r} ({err}).",
+                        location=self.get_location()
+                    )
+                    included = expression not in excl
 
                 # Keep the entries that are not supposed to be excluded
-                if filt not in excl:
-                    filtered.append(e.replace(":" + filt + ":", ""))
+                if included:
+                    filtered.append(
+                        e[:m.start(group) - 1] + e[m.end(group) + 1:]
+                    )
             else:
                 filtered.append(e)
         return filtered
 
     def run(self):
+        # Remember the document, so that it is read again if the filters
+        # change (see find_outdated)
+        env = self.state.document.settings.env
+        env.filtered_toc_docs.add(env.docname)
+
         # Remove all TOC entries that should not be included
         self.content = self.filter_entries(self.content)
         return super().run()
@@ -0,0 +1,127 @@
+######################################################################
+# A shared HTTP client for the extensions that fetch data over the
+# network.
+#
+# All requests go through a single requests.Session per process, so
+# connections to the same host are kept alive and reused. Requests
+# time out, are retried with an exponential backoff, and the number
+# of requests that are in flight at the same time is limited.
+#
+# The behaviour can be configured in conf.py:
+#
+#   http_timeout = 30           # seconds
+#   http_retries = 3
+#   http_backoff_factor = 0.5   # seconds
+#   http_max_concurrency = 8
+######################################################################
+
+import contextlib
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+defaults = {
+    "http_timeout": 30,
+    "http_retries": 3,
+    "http_backoff_factor": 0.5,
+    "http_max_concurrency": 8,
+}
+
+
+class HTTPClient:
+    def __init__(self, settings):
+        self.settings = dict(settings)
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._semaphore = threading.BoundedSemaphore(
+            self.settings["http_max_concurrency"]
+        )
+
+    def session(self):
+        with self._lock:
+            # Connections can't be shared with forked processes (for
+            # example, parallel Sphinx workers), so each process gets its
+            # own session
+            if self._session is None or self._session_pid != os.getpid():
+                retry = Retry(
+                    total=self.settings["http_retries"],
+                    backoff_factor=self.settings["http_backoff_factor"],
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=("GET", "HEAD"),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=self.settings["http_max_concurrency"],
+                    pool_maxsize=self.settings["http_max_concurrency"],
+                    max_retries=retry,
+                )
+                self._session = requests.Session()
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+                self._session_pid = os.getpid()
+            return self._session
+
+    # The body is read before the response is returned, so the request
+    # is no longer in flight at that point
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.settings["http_timeout"])
+        with self._semaphore:
+            return self.session().get(url, stream=False, **kwargs)
+
+    # Streamed responses are read after they are returned, so they count
+    # as in flight until they are closed at the end of the with block
+    @contextlib.contextmanager
+    def stream(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.settings["http_timeout"])
+        with self._semaphore:
+            with self.session().get(url, stream=True, **kwargs) as r:
+                yield r
+
+
+# The client that is used outside of a Sphinx build; in a build, it is
+# replaced with the one that is kept on the application
+client = HTTPClient(defaults)
+
+
+def setup(app):
+    # Several extensions use this module, but the config values can only
+    # be registered once
+    if "http_timeout" not in app.config:
+        for name, default in defaults.items():
+            app.add_config_value(name, default, "")
+    app.connect("config-inited", configure)
+
+
+# This file is symlinked into each extension, so Python loads a separate
+# copy of it for each of them. The client is created once and kept on the
+# application, and all copies use it, so that the extensions share the
+# session and the limit of requests in flight.
+def configure(app, config):
+    global client
+    if not hasattr(app, "canonical_http_client"):
+        app.canonical_http_client = HTTPClient(
+            {name: config[name] for name in defaults}
+        )
+    client = app.canonical_http_client
+
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
+
+
+def stream(url, **kwargs):
+    return client.stream(url, **kwargs)
+
+
+# Send a conditional request if validators from an earlier response are
+# given; the server then answers with 304 if the document is unchanged
+def get_if_modified(url, etag=None, last_modified=None, **kwargs):
+    headers = dict(kwargs.pop("headers", None) or {})
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return get(url, headers=headers, **kwargs)
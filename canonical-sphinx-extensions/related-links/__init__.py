@@ -89,11 +89,22 @@
 
 import requests
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from sphinx.util import logging
 from . import common
+from . import httpclient
+from .cache import PersistentCache
 
+# Titles and errors for the URLs that have been fetched in this build
+# (these are the ".json" URLs for Discourse topics)
 cache = {}
+errors = {}
+
+# Titles and validators (ETag and Last-Modified headers) from earlier
+# builds, which is set up when the builder is initialised (see init_store)
+store = None
 logger = logging.getLogger(__name__)
 
 
@@ -104,64 +115,177 @@ def log_warning(pagename, err, title):
     logger.warning(msg, type="canonical-sphinx-extensions", subtype="linktext")
 
 
+# Split "[Link text](target)" and "{Backup text}(target)" into the
+# target, the link text and the backup text
+def split_entry(entry):
+    if entry.startswith("[") and entry.endswith(")"):
+        split = entry.partition("](")
+        return split[2][:-1], split[0][1:], ""
+    elif entry.startswith("{") and entry.endswith(")"):
+        split = entry.partition("}(")
+        return split[2][:-1], "", split[0][1:]
+    else:
+        return entry, "", ""
+
+
+def split_list(value):
+    return value.strip().replace(" ", "").split(",")
+
+
+# Determine the linkurl (which Discourse to link to) and strip this
+# information from the post. Returns None if the prefix isn't defined.
+def parse_discourse_post(post, prefixes):
+    if type(prefixes) is dict:
+        ID = post.split(":")
+        if len(ID) == 1:
+            return list(prefixes.values())[0], post
+        elif ID[0] in prefixes:
+            return prefixes[ID[0]], ID[1]
+        else:
+            return None
+    else:
+        return prefixes, post
+
+
+def get_discourse_title(r):
+    return json.loads(r.text)["title"]
+
+
+def get_page_title(r):
+    soup = BeautifulSoup(r.text, "html.parser")
+    if soup.title is None:
+        return None
+    return soup.title.get_text()
+
+
+# Fetch the title, or only revalidate it if it was stored before
+def fetch_title(url, get_title):
+    stored = store.get(url) if store is not None else None
+    try:
+        if stored is not None:
+            r = httpclient.get_if_modified(
+                url, stored["etag"], stored["last_modified"]
+            )
+            if r.status_code == 304:
+                cache[url] = stored["title"]
+                return
+        else:
+            r = httpclient.get(url)
+        r.raise_for_status()
+        title = get_title(r)
+        if title is None:
+            errors[url] = url + " doesn't have a title."
+            return
+        cache[url] = title
+        if store is not None:
+            store.set(url, {
+                "title": title,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            })
+    except requests.HTTPError as err:
+        errors[url] = str(err)
+    except requests.ConnectionError as err:
+        errors[url] = str(err)
+    except requests.Timeout as err:
+        errors[url] = str(err)
+
+
+# Return the title for the URL, or the backup text if the title could
+# not be retrieved
+def lookup_title(pagename, url, get_title, backup):
+    if url not in cache and url not in errors:
+        # Not collected up front (see resolve_titles)
+        fetch_title(url, get_title)
+    if url in cache:
+        return cache[url]
+    log_warning(pagename, errors[url], backup)
+    return backup
+
+
+# Collect the links from the metadata of all pages once the documents
+# have been read, and fetch the titles of all unique URLs in parallel.
+# This way, writing the pages doesn't need to wait for the network.
+def resolve_titles(app, env):
+    # Only HTML pages show the related links
+    if app.builder.format != "html":
+        return
+
+    prefixes = app.config.html_context.get("discourse_prefix")
+    urls = {}
+
+    for metadata in env.metadata.values():
+        if prefixes and metadata.get("discourse"):
+            for post in split_list(metadata["discourse"]):
+                parsed = parse_discourse_post(post, prefixes)
+                if parsed is None:
+                    continue
+                linkurl, postID = parsed
+                postID, title, _backup = split_entry(postID)
+                if not title:
+                    urls[linkurl + postID + ".json"] = get_discourse_title
+        if metadata.get("relatedlinks"):
+            for link in split_list(metadata["relatedlinks"]):
+                link, title, _backup = split_entry(link)
+                if not title:
+                    urls[link] = get_page_title
+
+    missing = [
+        (url, get_title)
+        for url, get_title in urls.items()
+        if url not in cache and url not in errors
+    ]
+    if not missing:
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=httpclient.client.settings["http_max_concurrency"]
+    ) as executor:
+        for future in [
+            executor.submit(fetch_title, url, get_title)
+            for url, get_title in missing
+        ]:
+            future.result()
+
+
+def init_store(app):
+    global store
+    store = PersistentCache(os.path.join(app.doctreedir, "related-links.json"))
+
+
+def save_store(app, exc):
+    if store is not None:
+        store.save()
+
+
 def setup_func(app, pagename, templatename, context, doctree):
     def discourse_links(IDlist):
 
         if context["discourse_prefix"] and IDlist:
 
-            posts = IDlist.strip().replace(" ", "").split(",")
-
             linklist = "<ul>"
 
-            for post in posts:
-                title = ""
-                postID = post
-
-                # determine the linkurl (which Discourse to link to)
-                # and strip this information from the postID
-                if type(context["discourse_prefix"]) is dict:
-                    ID = post.split(":")
-                    if len(ID) == 1:
-                        linkurl = list(context["discourse_prefix"].values())[0]
-                    elif ID[0] in context["discourse_prefix"]:
-                        linkurl = context["discourse_prefix"][ID[0]]
-                        postID = ID[1]
-                    else:
-                        logger.warning(
-                            pagename
-                            + ": Discourse prefix "
-                            + ID[0]
-                            + " is not defined."
-                        )
-                        continue
-                else:
-                    linkurl = context["discourse_prefix"]
+            for post in split_list(IDlist):
+                parsed = parse_discourse_post(
+                    post, context["discourse_prefix"]
+                )
+                if parsed is None:
+                    logger.warning(
+                        pagename
+                        + ": Discourse prefix "
+                        + post.split(":")[0]
+                        + " is not defined."
+                    )
+                    continue
+                linkurl, postID = parsed
 
                 # determine the title (and maybe strip it from the postID)
-                if post in cache:
-                    title = cache[post]
-                elif postID.startswith("[") and postID.endswith(")"):
-                    split = postID.partition("](")
-                    title = split[0][1:]
-                    postID = split[2][:-1]
-                else:
-
-                    if postID.startswith("{") and postID.endswith(")"):
-                        split = postID.partition("}(")
-                        # if a backup link text exist, fall back on it if no
-                        # other title can be retrieved
-                        title = split[0][1:]
-                        postID = split[2][:-1]
-
-                    try:
-                        r = requests.get(linkurl + postID + ".json")
-                        r.raise_for_status()
-                        title = json.loads(r.text)["title"]
-                        cache[post] = title
-                    except requests.HTTPError as err:
-                        log_warning(pagename, str(err), title)
-                    except requests.ConnectionError as err:
-                        log_warning(pagename, str(err), title)
+                postID, title, backup = split_entry(postID)
+                if not title:
+                    title = lookup_title(
+                        pagename, linkurl + postID + ".json",
+                        get_discourse_title, backup
+                    )
 
                 if title:
                     linklist += '<li><a href="' + linkurl + postID
@@ -178,44 +302,16 @@ def setup_func(app, pagename, templatename, context, doctree):
 
         if linklist:
 
-            links = linklist.strip().replace(" ", "").split(",")
+            links = split_list(linklist)
 
             linklist = "<ul>"
 
             for link in links:
-                title = ""
-
-                if link in cache:
-                    title = cache[link]
-                elif link.startswith("[") and link.endswith(")"):
-                    split = link.partition("](")
-                    title = split[0][1:]
-                    link = split[2][:-1]
-                else:
-
-                    if link.startswith("{") and link.endswith(")"):
-                        split = link.partition("}(")
-                        # if a backup link text exist, fall back on it if no
-                        # other title can be retrieved
-                        title = split[0][1:]
-                        link = split[2][:-1]
-
-                    try:
-                        r = requests.get(link)
-                        r.raise_for_status()
-                        soup = BeautifulSoup(r.text, "html.parser")
-                        if soup.title is None:
-                            log_warning(
-                                pagename, link + " doesn't have a title.",
-                                title
-                            )
-                        else:
-                            title = soup.title.get_text()
-                            cache[link] = title
-                    except requests.HTTPError as err:
-                        log_warning(pagename, str(err), title)
-                    except requests.ConnectionError as err:
-                        log_warning(pagename, str(err), title)
+                link, title, backup = split_entry(link)
+                if not title:
+                    title = lookup_title(
+                        pagename, link, get_page_title, backup
+                    )
 
                 if title:
                     linklist += '<li><a href="' + link + '" target="_blank">'
@@ -233,7 +329,11 @@ def setup_func(app, pagename, templatename, context, doctree):
 
 
 def setup(app):
+    app.connect("builder-inited", init_store)
+    app.connect("env-updated", resolve_titles)
     app.connect("html-page-context", setup_func)
+    app.connect("build-finished", save_store)
+    httpclient.setup(app)
 
     common.add_css(app, "related-links.css")
 
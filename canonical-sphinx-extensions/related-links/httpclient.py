@@ -0,0 +1 @@
+../httpclient.py
\ No newline at end of file
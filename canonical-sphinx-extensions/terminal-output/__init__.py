@@ -2,27 +2,94 @@ from docutils import nodes
 from sphinx.util.docutils import SphinxDirective
 from docutils.parsers.rst import directives
 from . import common
+import json
+import os
 import sphinx
 from sphinx.application import Sphinx
+from sphinx.config import ENUM
 
+# The HTML of the folded lines of each document in "file" mode, which is
+# collected while the document is written (see depart_fold) and saved
+# when the page is written (see save_folds)
+renderedFolds = {}
 
 copybutton_classes = "div.terminal.copybutton > div.container > code.command, div:not(.terminal-code, .no-copybutton) > div.highlight > pre"
 
 
-def parse_contents(contents):
-    command_output = []
-    out = []
-
-    for line in contents:
+# Go through the lines of the content and yield the spans of lines as
+# (kind, start, end) tuples, where kind is "input" for a line that starts
+# with ":input: " and "output" for the lines between them. Empty output
+# spans are skipped, so the lines don't need to be copied.
+def iter_contents(lines):
+    start = 0
+    for i, line in enumerate(lines):
         if line.startswith(":input: "):
-            out.append(command_output)
-            out.append([line])
-            command_output = []
-        else:
-            command_output.append(line)
+            if start < i:
+                yield "output", start, i
+            yield "input", i, i + 1
+            start = i + 1
+    if start < len(lines):
+        yield "output", start, len(lines)
+
+
+# The lines of a long output block that are hidden until they are
+# expanded. Builders other than HTML handle this node like any other
+# container, so they show all lines.
+class terminal_fold(nodes.container):
+    pass
+
+
+# Builders that use the HTML handlers because of their format (for example,
+# epub) don't include the files with the folded lines, and not all readers
+# can expand <details>, so they get all lines in the page
+fold_builders = ("html", "dirhtml")
+
+
+def visit_fold(self, node):
+    if self.builder.name not in fold_builders:
+        self.visit_container(node)
+        return
+    attributes = {}
+    if node["fold"] == "file":
+        pageFolds = renderedFolds.setdefault(self.builder.current_docname, [])
+        attributes["data-fold"] = len(pageFolds)
+    self.body.append(self.starttag(node, "details", **attributes))
+    lines = "line" if node["lines"] == 1 else "lines"
+    self.body.append(f"<summary>{node['lines']} more {lines}</summary>\n")
+    self.context.append(len(self.body))
+
+
+# In "file" mode, move the HTML of the folded lines out of the page
+def depart_fold(self, node):
+    if self.builder.name not in fold_builders:
+        self.depart_container(node)
+        return
+    start = self.context.pop()
+    if node["fold"] == "file":
+        renderedFolds[self.builder.current_docname].append(
+            "".join(self.body[start:])
+        )
+        del self.body[start:]
+    self.body.append("</details>\n")
+
+
+# Write the folded lines that were moved out of the page to a script that
+# is loaded when the first fold is expanded (see terminal-output.js)
+def save_folds(app, pagename, templatename, context, doctree):
+    pageFolds = renderedFolds.pop(pagename, None)
+    if not pageFolds:
+        return
 
-    out.append(command_output)
-    return out
+    filename = os.path.join("_terminal-output", pagename + ".js")
+    path = os.path.join(app.outdir, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("window.terminalOutputFolds = ")
+        json.dump(pageFolds, f, separators=(",", ":"))
+        f.write(";\n")
+
+    context["metatags"] += '\n<meta name="terminal-output-folds" ' \
+        + 'content="' + context["pathto"](filename, 1) + '" />'
 
 
 class TerminalOutput(SphinxDirective):
@@ -38,6 +105,8 @@ class TerminalOutput(SphinxDirective):
         "dir": directives.unchanged,
         "scroll": directives.unchanged,
         "copy": directives.unchanged,
+        "max-lines": directives.nonnegative_int,
+        "fold": lambda arg: directives.choice(arg, ("details", "file")),
     }
 
     @staticmethod
@@ -61,6 +130,31 @@ class TerminalOutput(SphinxDirective):
         # inpline.append(nodes.paragraph())
         return inpline
 
+    @staticmethod
+    def output_block(lines):
+        output = nodes.literal_block(text="\n".join(lines))
+        output["classes"].append("terminal-code")
+        return output
+
+    # Add an output block. If it is longer than max_lines, only the first
+    # and last lines are shown and the lines in between are folded.
+    def add_output(self, out, lines, start, end, max_lines, fold):
+        if not max_lines or end - start <= max_lines:
+            out.append(self.output_block(lines[start:end]))
+            return
+
+        tail = max_lines // 2
+        head = max_lines - tail
+        out.append(self.output_block(lines[start:start + head]))
+        folded = terminal_fold(
+            "", self.output_block(lines[start + head:end - tail]),
+            lines=end - start - max_lines, fold=fold
+        )
+        folded["classes"].append("terminal-fold")
+        out.append(folded)
+        if tail:
+            out.append(self.output_block(lines[end - tail:end]))
+
     def run(self):
         # if :user: or :host: are provided, replace those in the prompt
 
@@ -106,22 +200,38 @@ class TerminalOutput(SphinxDirective):
         # except for the ones that start with ":input: " - those get
         # a prompt
 
-        parsed_content = parse_contents(self.content)
+        # Long output blocks are folded (see add_output)
+
+        lines = self.content.data
+        config = self.env.config
+        max_lines = self.options.get("max-lines", config.terminal_max_lines)
+        fold = self.options.get("fold", config.terminal_fold)
 
-        for blob in filter(None, parsed_content):
-            if blob[0].startswith(":input: "):
-                out.append(self.input_line(prompt_text, blob[0][len(":input: "):]))
+        for kind, start, end in iter_contents(lines):
+            if kind == "input":
+                out.append(
+                    self.input_line(prompt_text, lines[start][len(":input: "):])
+                )
             else:
-                output = nodes.literal_block(text="\n".join(blob))
-                output["classes"].append("terminal-code")
-                out.append(output)
+                self.add_output(out, lines, start, end, max_lines, fold)
         return [out]
 
 
 def setup(app: Sphinx):
+    app.add_config_value("terminal_max_lines", 0, "env")
+    app.add_config_value(
+        "terminal_fold", "details", "env", ENUM("details", "file")
+    )
     app.add_directive("terminal", TerminalOutput)
+    app.add_node(
+        terminal_fold,
+        html=(visit_fold, depart_fold),
+        dirhtml=(visit_fold, depart_fold),
+    )
+    app.connect("html-page-context", save_folds)
 
     common.add_css(app, "terminal-output.css")
+    common.add_js(app, "terminal-output.js")
     if "copybutton_selector" not in app.config._raw_config:
         app.config._raw_config.setdefault("copybutton_selector", copybutton_classes)
     if app.config._raw_config["copybutton_selector"] == "div.highlight pre":
@@ -0,0 +1,44 @@
+document.addEventListener('DOMContentLoaded', function() {
+
+    /* In "file" mode, the folded lines of long terminal output are not part
+       of the page. They are loaded from a separate file when the first
+       fold is expanded. */
+    var meta = document.querySelector('meta[name="terminal-output-folds"]');
+    if (meta === null) {
+        return;
+    }
+    var source = meta.getAttribute('content');
+    var loaded = null;
+
+    function loadFolds() {
+        if (loaded === null) {
+            loaded = new Promise(function(resolve, reject) {
+                var script = document.createElement('script');
+                script.src = source;
+                script.onload = function() {
+                    resolve(window.terminalOutputFolds);
+                };
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        return loaded;
+    }
+
+    /* The toggle event doesn't bubble, so the handler is attached to the
+       document in the capture phase instead of to every fold */
+    document.addEventListener('toggle', function(event) {
+        var fold = event.target;
+        if (!fold.open || !fold.hasAttribute('data-fold')) {
+            return;
+        }
+        loadFolds().then(function(data) {
+            var index = fold.getAttribute('data-fold');
+            if (index !== null) {
+                fold.insertAdjacentHTML('beforeend', data[index]);
+                fold.removeAttribute('data-fold');
+            }
+        });
+    }, true);
+
+});
@@ -113,6 +113,7 @@ Examples of usage::
 from __future__ import annotations
 
 import io
+import os
 import re
 import time
 import functools
@@ -120,16 +121,24 @@ import itertools
 import contextlib
 import typing as t
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parsedate
 from html.parser import HTMLParser
-from urllib.request import urlopen
-from urllib.error import HTTPError
 
 from docutils import nodes
+from requests import HTTPError
 from sphinx.application import Sphinx
 from sphinx.util.docutils import SphinxDirective
 from sphinx.addnodes import download_reference
 
+try:
+    from . import httpclient
+    from .cache import PersistentCache
+except ImportError:
+    # When run directly for the test-suite, the module isn't in a package
+    import httpclient  # type: ignore
+    from cache import PersistentCache  # type: ignore
+
 if t.TYPE_CHECKING:
     from typing import ClassVar
     from sphinx.util.typing import ExtensionMetadata, OptionSpec
@@ -138,6 +147,9 @@ if t.TYPE_CHECKING:
 def setup(app: Sphinx) -> ExtensionMetadata:
     "Called by Sphinx to install the extension."
     app.add_directive('ubuntu-images', UbuntuImagesDirective)
+    app.connect('builder-inited', init_store)
+    app.connect('build-finished', save_store)
+    httpclient.setup(app)
 
     return {
         'version': '0.1',
@@ -146,6 +158,24 @@ def setup(app: Sphinx) -> ExtensionMetadata:
     }
 
 
+# The documents fetched in earlier builds along with their validators (the
+# ETag and Last-Modified headers); set up by init_store
+store: t.Optional[PersistentCache] = None
+
+
+def init_store(app: Sphinx) -> None:
+    "Called by Sphinx to load the documents stored by earlier builds."
+    global store
+    store = PersistentCache(
+        os.path.join(app.doctreedir, 'ubuntu-images.json'))
+
+
+def save_store(app: Sphinx, exc: t.Optional[Exception]) -> None:
+    "Called by Sphinx to store the fetched documents for later builds."
+    if store is not None:
+        store.save()
+
+
 def parse_set(s: str) -> set[str]:
     """
     Splits a :class:`str` *s* containing a comma or space-separated list of
@@ -218,13 +248,23 @@ class UbuntuImagesDirective(SphinxDirective):
             spec=self.options.get('releases', ''),
             lts=self.options.get('lts-only'),
             supported=True)
-        for release in reversed(releases):
+
+        def release_images(release: Release) -> ImageCatalog:
+            return get_catalog(
+                url=cdimage_template.format(release=release),
+                supported=release.supported)
+
+        # Fetch the images of all releases at once, rather than waiting for
+        # each release in turn
+        with ThreadPoolExecutor(
+            max_workers=httpclient.client.settings['http_max_concurrency']
+        ) as executor:
+            all_images = list(executor.map(release_images, releases))
+
+        for release, images in reversed(list(zip(releases, all_images))):
             release_item = nodes.list_item('', nodes.paragraph(
                 text=f'Ubuntu {release.version} ({release.name}) images:'))
-            images = filter_images(
-                get_images(
-                    url=cdimage_template.format(release=release),
-                    supported=release.supported),
+            images = images.filter(
                 archs=self.options.get('archs'),
                 image_types=self.options.get('image-types'),
                 suffixes=self.options.get('suffixes'),
@@ -348,6 +388,41 @@ image_re = re.compile(
     r'(?:\.(?P<compression>gz|bz2|xz|zst))?$')
 
 
+class ImageName(t.NamedTuple):
+    """
+    A named-tuple of the fields parsed from the filename of an image by
+    :data:`image_re`. See the properties of :class:`Image` for a description
+    of each field.
+    """
+
+    version: str
+    image_type: str
+    arch: str
+    suffix: str
+    file_type: str
+    compression: str
+
+
+def parse_image_name(name: str) -> t.Optional[ImageName]:
+    """
+    Parse the filename *name* of an image into an :class:`ImageName`, or
+    return :data:`None` if *name* isn't the filename of an image. For
+    example::
+
+        >>> parse_image_name('ubuntu-24.04.1-live-server-arm64.iso')
+        ... # doctest: +NORMALIZE_WHITESPACE
+        ImageName(version='24.04.1', image_type='live-server', arch='arm64',
+        suffix='', file_type='iso', compression='')
+        >>> parse_image_name('SHA256SUMS') is None
+        True
+    """
+    matched = image_re.match(name)
+    if matched is None:
+        return None
+    return ImageName(*(matched.group(field) or ''
+                       for field in ImageName._fields))
+
+
 class Image(t.NamedTuple):
     """
     A named-tuple representing a single OS image on cdimage.ubuntu.com.
@@ -367,17 +442,27 @@ class Image(t.NamedTuple):
     .. attribute:: sha256
 
         A :class:`str` containing the SHA256 checksum of the file.
+
+    .. attribute:: parsed
+
+        The :class:`ImageName` parsed from :attr:`name`. This is filled in by
+        :func:`get_images` so that the properties below don't need to parse
+        the name on each access. If it is :data:`None`, the name is parsed
+        when needed.
     """
 
     url: str
     name: str
     date: dt.date
     sha256: str
+    parsed: t.Optional[ImageName] = None
 
     def _parse_field(self, field: str) -> str:
-        matched = image_re.match(self.name)
-        assert matched is not None
-        return matched.group(field) or ''
+        parsed = self.parsed
+        if parsed is None:
+            parsed = parse_image_name(self.name)
+            assert parsed is not None
+        return getattr(parsed, field)
 
     @property
     def version(self) -> str:
@@ -429,6 +514,59 @@ class Image(t.NamedTuple):
         return self._parse_field('compression')
 
 
+def fetch_text(url: str) -> str:
+    """
+    Fetch the UTF-8 encoded document at *url* through the shared HTTP client
+    and return it as a :class:`str`. Raises :exc:`~requests.HTTPError` if
+    the server returns an error status.
+
+    If the :data:`store` is set up and holds the document from an earlier
+    build, the request is made conditional on the stored validators, and the
+    stored document is returned if the server reports it as unchanged. For
+    example::
+
+        >>> import tempfile
+        >>> from unittest import mock
+        >>> statuses = []
+        >>> def get(url, _get=httpclient.get, **kwargs):
+        ...     response = _get(url, **kwargs)
+        ...     statuses.append(response.status_code)
+        ...     return response
+        >>> with (
+        ...     tempfile.TemporaryDirectory() as tmp,
+        ...     _test_server(_make_releases()) as url,
+        ...     mock.patch.object(httpclient, 'get', get),
+        ...     mock.patch('__main__.store',
+        ...                PersistentCache(tmp + '/store.json')),
+        ... ):
+        ...     first = fetch_text(url + 'meta-release')
+        ...     second = fetch_text(url + 'meta-release')
+        >>> statuses
+        [200, 304]
+        >>> first == second
+        True
+    """
+    stored = store.get(url) if store is not None else None
+    if stored is None:
+        response = httpclient.get(url)
+    else:
+        response = httpclient.get_if_modified(
+            url, stored['etag'], stored['last_modified'])
+        if response.status_code == 304:
+            return stored['body']
+    response.raise_for_status()
+    text = response.content.decode('utf-8', errors='strict')
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if store is not None and (etag or last_modified):
+        store.set(url, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': text,
+        })
+    return text
+
+
 @functools.lru_cache()
 def get_releases(
     urls: tuple[str] = ('https://changelogs.ubuntu.com/meta-release',),
@@ -452,12 +590,8 @@ def get_releases(
     """
     releases = {}
     for url in urls:
-        with (
-            urlopen(url) as data,
-            io.TextIOWrapper(data, encoding='utf-8', errors='strict') as text
-        ):
-            for release in meta_parser(text):
-                releases[release.codename] = release
+        for release in meta_parser(io.StringIO(fetch_text(url))):
+            releases[release.codename] = release
     return list(releases.values())
 
 
@@ -557,19 +691,22 @@ def get_images(url: str, supported: bool = True) -> list[Image]:
         Image(url='http://.../ubuntu-21.10-bar-arm64+raspi.img.xz',
         name='ubuntu-21.10-bar-arm64+raspi.img.xz',
         date=datetime.date(2021, 10, 25),
-        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...')
+        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...',
+        parsed=ImageName(version='21.10', image_type='bar', arch='arm64',
+        suffix='+raspi', file_type='img', compression='xz'))
     """
     # pylint: disable=too-many-locals
     # NOTE: This code relies on the current layout of pages on
     # cdimage.ubuntu.com; if extra tables or columns are introduced or
     # re-ordered this will need revisiting...
     parser = TableParser()
+    # The checksums are fetched alongside the index; whether they should
+    # exist is only checked once the index has been parsed
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        page = executor.submit(fetch_text, url)
+        sums = executor.submit(fetch_text, url + 'SHA256SUMS')
     try:
-        with (
-            urlopen(url) as data,
-            io.TextIOWrapper(data, encoding='utf-8', errors='strict') as page,
-        ):
-            parser.feed(page.read())
+        parser.feed(page.result())
     except HTTPError:
         # Supported releases should *always* have images
         raise ValueError(
@@ -591,22 +728,18 @@ def get_images(url: str, supported: bool = True) -> list[Image]:
         raise ValueError(f'SHA256SUMS file is missing from {url}')
     # Add SHA256 checksums and filter out anything that isn't an image
     result = []
-    with (
-        urlopen(url + 'SHA256SUMS') as data,
-        io.TextIOWrapper(data, encoding='utf-8', errors='strict') as hashes
-    ):
-        for line in hashes:
-            cksum, name = line.strip().split(None, 1)
-            cksum = cksum.strip().lower()
-            if name.startswith('*'):
-                name = name[1:]
-            try:
-                url, date = files[name]
-                image = Image(url, name, date, cksum)
-                if image_re.match(image.name):
-                    result.append(image)
-            except (KeyError, ValueError):
-                continue
+    for line in sums.result().splitlines():
+        cksum, name = line.strip().split(None, 1)
+        cksum = cksum.strip().lower()
+        if name.startswith('*'):
+            name = name[1:]
+        try:
+            url, date = files[name]
+        except KeyError:
+            continue
+        parsed = parse_image_name(name)
+        if parsed is not None:
+            result.append(Image(url, name, date, cksum, parsed))
     return result
 
 
@@ -621,7 +754,7 @@ def filter_images(
     Filters *images*, a sequence of :class:`Image` tuples, according to the
     options specified in the ubuntu-images directive. See the documentation of
     :class:`UbuntuImageDirective` for a detailed description of these options.
-    For example::
+    The images are filtered through an :class:`ImageCatalog`. For example::
 
         >>> foo = b'foo' * 123456
         >>> images = {
@@ -648,14 +781,112 @@ def filter_images(
         ['ubuntu-24.04.1-live-server-riscv64.img.gz',
         'ubuntu-24.04.1-preinstalled-server-riscv64+unmatched.img.xz']
     """
-    return [
-        image
-        for image in images
-        if (archs is None or image.arch in archs)
-        and (image_types is None or image.image_type in image_types)
-        and (suffixes is None or image.suffix in suffixes)
-        and (matches is None or matches.search(image.name))
-    ]
+    return ImageCatalog(images).filter(
+        archs=archs, image_types=image_types, suffixes=suffixes,
+        matches=matches)
+
+
+class ImageCatalog:
+    """
+    An index over *images*, a sequence of :class:`Image` tuples, which answers
+    the queries of :func:`filter_images` without scanning every image.
+
+    For each of the :attr:`indexed_fields`, the catalog maps every value of the
+    field to the set of positions of the images with that value. A query takes
+    the intersection of these sets, and only the remaining candidates are
+    matched against the regular expression (if any). The result is in the
+    same order as *images*. For example::
+
+        >>> foo = b'foo' * 123456
+        >>> images = {
+        ... 'ubuntu-24.04.1-live-server-riscv64.img.gz': foo,
+        ... 'ubuntu-24.04.1-live-server-arm64.iso': foo,
+        ... 'ubuntu-24.04.1-preinstalled-server-armhf+raspi.img.xz': foo,
+        ... 'ubuntu-24.04.1-preinstalled-server-arm64+raspi.img.xz': foo,
+        ... 'ubuntu-24.04.1-preinstalled-desktop-arm64+raspi.img.xz': foo,
+        ... }
+        >>> with _test_server(_make_index(_make_sums(images))) as url:
+        ...     catalog = ImageCatalog(get_images(url))
+        >>> len(catalog)
+        5
+        >>> [i.name for i in catalog.filter(archs={'arm64'},
+        ... image_types={'preinstalled-server', 'live-server'})]
+        ... # doctest: +NORMALIZE_WHITESPACE
+        ['ubuntu-24.04.1-live-server-arm64.iso',
+        'ubuntu-24.04.1-preinstalled-server-arm64+raspi.img.xz']
+        >>> [i.name for i in catalog.filter(suffixes={''}, archs={'riscv64'})]
+        ['ubuntu-24.04.1-live-server-riscv64.img.gz']
+        >>> [i.name for i in catalog.filter(archs={'s390x'})]
+        []
+        >>> regex = re.compile(r'desktop')
+        >>> [i.name for i in catalog.filter(archs={'arm64'}, matches=regex)]
+        ['ubuntu-24.04.1-preinstalled-desktop-arm64+raspi.img.xz']
+        >>> catalog.filter() == list(catalog)
+        True
+    """
+
+    indexed_fields = ('arch', 'image_type', 'suffix')
+
+    def __init__(self, images: t.Sequence[Image]) -> None:
+        self.images = list(images)
+        self.index: dict[str, dict[str, set[int]]] = {
+            field: {} for field in self.indexed_fields
+        }
+        for pos, image in enumerate(self.images):
+            for field in self.indexed_fields:
+                self.index[field].setdefault(
+                    getattr(image, field), set()).add(pos)
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __iter__(self) -> t.Iterator[Image]:
+        return iter(self.images)
+
+    def filter(
+        self,
+        archs: t.Optional[set[str]] = None,
+        image_types: t.Optional[set[str]] = None,
+        suffixes: t.Optional[set[str]] = None,
+        matches: t.Optional[re.Pattern[str]] = None,
+    ) -> list[Image]:
+        """
+        Return the images matching all the given filters. See
+        :func:`filter_images` for their description.
+        """
+        candidates: t.Optional[set[int]] = None
+        for field, values in (
+            ('arch', archs),
+            ('image_type', image_types),
+            ('suffix', suffixes),
+        ):
+            if values is None:
+                continue
+            index = self.index[field]
+            selected = set().union(*(index.get(value, ()) for value in values))
+            candidates = (
+                selected if candidates is None else candidates & selected)
+            if not candidates:
+                return []
+        if candidates is None:
+            positions: t.Iterable[int] = range(len(self.images))
+        else:
+            positions = sorted(candidates)
+        return [
+            self.images[pos]
+            for pos in positions
+            if matches is None or matches.search(self.images[pos].name)
+        ]
+
+
+@functools.lru_cache
+def get_catalog(url: str, supported: bool = True) -> ImageCatalog:
+    """
+    Return an :class:`ImageCatalog` of the images returned by
+    :func:`get_images` for *url*. The catalog is built once per *url*, and
+    shared by all directives that list images from it.
+    """
+    return ImageCatalog(get_images(url, supported))
 
 
 def meta_parser(file: t.TextIO) -> t.Iterable[Release]:
@@ -1058,7 +1289,9 @@ __test__ = {
         Image(url='http://.../ubuntu-21.10-bar-arm64+raspi.img.xz',
         name='ubuntu-21.10-bar-arm64+raspi.img.xz',
         date=datetime.date(2021, 10, 25),
-        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...')
+        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...',
+        parsed=ImageName(version='21.10', image_type='bar', arch='arm64',
+        suffix='+raspi', file_type='img', compression='xz'))
     """,
 
     'ignore-extra-cksums': """
@@ -1079,7 +1312,9 @@ __test__ = {
         Image(url='http://.../ubuntu-21.10-bar-arm64+raspi.img.xz',
         name='ubuntu-21.10-bar-arm64+raspi.img.xz',
         date=datetime.date(2021, 10, 25),
-        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...')
+        sha256='e9cd9718e97ac951c0ead5de8069d0ff5de188620b12b02...',
+        parsed=ImageName(version='21.10', image_type='bar', arch='arm64',
+        suffix='+raspi', file_type='img', compression='xz'))
     """,
 
     'full-run': """
@@ -1245,5 +1480,6 @@ if __name__ == '__main__':
     # cleaner at least from the perspective of the tests themselves)
     get_releases = get_releases.__wrapped__  # type: ignore
     get_images = get_images.__wrapped__  # type: ignore
+    get_catalog = get_catalog.__wrapped__  # type: ignore
     failures, total = doctest.testmod()
     sys.exit(bool(failures))
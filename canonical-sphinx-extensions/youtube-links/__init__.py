@@ -2,10 +2,106 @@ from docutils import nodes
 from docutils.parsers.rst import Directive
 from docutils.parsers.rst import directives
 from . import common
+from . import httpclient
+from .cache import PersistentCache
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+from sphinx.util import logging
+import os
+import re
 import requests
-from bs4 import BeautifulSoup
 
-cache = {}
+logger = logging.getLogger(__name__)
+
+# Set up when the builder is initialised (see init_cache)
+cache = None
+
+# Matches the directive in rST (".. youtube:: URL") and in MyST
+# ("```{youtube} URL" or ":::{youtube} URL")
+findDirective = re.compile(
+    r"^\s*(?:\.\.\s+youtube::|(?:`{3,}|:{3,})\{youtube\})\s+(\S+)"
+)
+findOption = re.compile(r"^\s*:([\w-]+):")
+
+
+youtube_hosts = {"youtube.com", "www.youtube.com", "m.youtube.com",
+                 "youtu.be"}
+
+
+class TitleParser(HTMLParser):
+    """
+    Collects the text of the first ``<title>`` tag of an HTML page, which
+    might be fed in pieces. :attr:`done` is set as soon as the closing tag
+    has been seen, so the rest of the page doesn't need to be read.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_title = False
+        self.done = False
+        self.title = ""
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.done:
+            self.in_title = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            self.done = True
+
+
+# Ask the YouTube oEmbed endpoint, which returns a small JSON document
+# that contains the title
+def oembed_title(url):
+    if urlparse(url).hostname not in youtube_hosts:
+        return None
+    r = httpclient.get(
+        "https://www.youtube.com/oembed",
+        params={"url": url, "format": "json"}
+    )
+    r.raise_for_status()
+    return r.json().get("title")
+
+
+# Read the page until the end of its <title> tag
+def page_title(url):
+    with httpclient.stream(url) as r:
+        r.raise_for_status()
+        if r.encoding is None:
+            r.encoding = "utf-8"
+        parser = TitleParser()
+        for chunk in r.iter_content(chunk_size=8192, decode_unicode=True):
+            parser.feed(chunk)
+            if parser.done:
+                break
+        return parser.title if parser.done else None
+
+
+# The functions that are tried in order to find the title of a video.
+# Each takes the URL of the video and returns the title, or None if it
+# cannot determine it.
+title_resolvers = [oembed_title, page_title]
+
+
+def fetch_title(url):
+    error = None
+    for resolver in title_resolvers:
+        try:
+            title = resolver(url)
+        except (requests.RequestException, ValueError) as err:
+            error = err
+            continue
+        if title:
+            return title
+    if error is not None:
+        raise error
+    return ""
 
 
 class YouTubeLink(Directive):
@@ -22,16 +118,20 @@ class YouTubeLink(Directive):
         if "title" in self.options:
             title = self.options["title"]
         elif self.arguments[0] in cache:
-            title = cache[self.arguments[0]]
+            title = cache.get(self.arguments[0])
         else:
             try:
-                r = requests.get(self.arguments[0])
-                r.raise_for_status()
-                soup = BeautifulSoup(r.text, "html.parser")
-                title = soup.title.get_text()
-                cache[self.arguments[0]] = title
-            except requests.HTTPError as err:
-                print(err)
+                title = fetch_title(self.arguments[0])
+                if title:
+                    cache.set(self.arguments[0], title)
+            except (requests.RequestException, ValueError) as err:
+                logger.warning(
+                    f"Failed to retrieve the title of {self.arguments[0]}: "
+                    + str(err),
+                    location=(
+                        self.state.document.settings.env.docname, self.lineno
+                    ),
+                )
 
         fragment = (
             ' \
@@ -53,8 +153,82 @@ class YouTubeLink(Directive):
         return [raw]
 
 
+def init_cache(app):
+    global cache
+    cache = PersistentCache(
+        os.path.join(app.doctreedir, "youtube-titles.json"),
+        ttl=app.config.youtube_cache_ttl,
+        max_entries=app.config.youtube_cache_max_entries,
+    )
+
+
+def find_urls(lines):
+    urls = []
+    url = None
+    for line in lines:
+        if url is not None:
+            option = findOption.match(line)
+            if option is not None:
+                # No need to fetch a title that is overridden
+                if option.group(1) == "title":
+                    url = None
+                continue
+            urls.append(url)
+            url = None
+        m = findDirective.match(line)
+        if m is not None:
+            url = m.group(1)
+    if url is not None:
+        urls.append(url)
+    return urls
+
+
+# Fetch the titles for all videos in the documents that are about to be
+# read at once, so that the directives only need to look them up
+def prefetch_titles(app, env, docnames):
+    urls = set()
+    for docname in docnames:
+        try:
+            with open(env.doc2path(docname),
+                      encoding=app.config.source_encoding) as f:
+                urls.update(find_urls(f))
+        except (OSError, UnicodeDecodeError):
+            continue
+
+    missing = [url for url in urls if url not in cache]
+    if not missing:
+        return
+
+    def fetch(url):
+        try:
+            return url, fetch_title(url)
+        except (requests.RequestException, ValueError):
+            # The directive reports the error when it runs
+            return url, None
+
+    with ThreadPoolExecutor(
+        max_workers=app.config.youtube_prefetch_workers
+    ) as executor:
+        for url, title in executor.map(fetch, missing):
+            if title:
+                cache.set(url, title)
+
+
+def save_cache(app, exc):
+    if cache is not None:
+        cache.save()
+
+
 def setup(app):
+    # Titles are kept for 30 days by default
+    app.add_config_value("youtube_cache_ttl", 30 * 24 * 60 * 60, "")
+    app.add_config_value("youtube_cache_max_entries", 1000, "")
+    app.add_config_value("youtube_prefetch_workers", 8, "")
     app.add_directive("youtube", YouTubeLink)
+    httpclient.setup(app)
+    app.connect("builder-inited", init_cache)
+    app.connect("env-before-read-docs", prefetch_titles)
+    app.connect("build-finished", save_cache)
 
     common.add_css(app, "youtube.css")
 